@@ -12,7 +12,11 @@
 # In[1]:
 
 
+import io
+import os
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
 
@@ -25,19 +29,43 @@ import pandas as pd
 cp_csv_dir = pathlib.Path("./cellprofiler_csvs")
 cp_csv_dir.mkdir(parents=True, exist_ok=True)
 
-# Find all position txt files in the current directory starting with "slide" using glob
-position_files = pathlib.Path().resolve().glob('slide*')
+# Find all position txt files in the current directory starting with "slide" using glob (listed once and reused for the platemaps)
+position_files = list(pathlib.Path().resolve().glob('slide*'))
+
+
+def read_position_file(file: pathlib.Path) -> pd.DataFrame:
+    """
+    Read a UTF-16 encoded, tab-delimited position file into a data frame.
+
+    pandas falls back to the slow Python parsing engine for UTF-16, so the bytes are decoded
+    once up front and the resulting text is parsed with the C engine.
+
+    Args:
+        file (pathlib.Path): path to the UTF-16 encoded position file
+
+    Returns:
+        pd.DataFrame: the position data frame
+    """
+    text = pathlib.Path(file).read_bytes().decode('utf-16')
 
-# Instantiate a empty list to append cellprofiler csvs to
-cp_csv_dfs = []
+    return pd.read_csv(io.StringIO(text), delimiter='\t', engine='c')
 
-# Iterate through each file to update "Point Name" and "Image" columns
-for file in position_files:
+
+def process_cp_csv_file(file: pathlib.Path) -> pd.DataFrame:
+    """
+    Update the "Point Name" and "Image" columns of a position file and save it as a CellProfiler CSV.
+
+    Args:
+        file (pathlib.Path): path to the UTF-16 encoded position file
+
+    Returns:
+        pd.DataFrame: the processed position data frame
+    """
     # Read the CSV file
-    df = pd.read_csv(file, delimiter='\t', encoding='utf-16')
+    df = read_position_file(file)
     
-    # Remove '#' prefix from 'Point Name' column
-    df['Point Name'] = df['Point Name'].str.lstrip('#')
+    # Remove the single '#' prefix from 'Point Name' column (every point name starts with one '#')
+    df['Point Name'] = df['Point Name'].str.removeprefix('#')
     
     # Zero-index the 'Image' column
     df['Image'] = df['Image'] - 1
@@ -45,9 +73,18 @@ for file in position_files:
     # Save the processed DataFrame to the cellprofiler csvs directory
     output_file = pathlib.Path(f"{cp_csv_dir}/{file.stem}.csv")
     df.to_csv(output_file, index=False)
-    
-    # Append the processed DataFrame to the list
-    cp_csv_dfs.append(df)
+
+    return df
+
+
+# Process the position files concurrently (parsing and writing release the GIL so threads are enough)
+with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+    cp_csv_dfs = list(executor.map(process_cp_csv_file, position_files))
+
+# Keep the parsed position data frames to reuse when generating the platemaps (avoids reading each file twice)
+parsed_position_dfs = {
+    file.stem: df for file, df in zip(position_files, cp_csv_dfs)
+}
 
 # Print the list of dataframes to verify that the process worked
 for df in cp_csv_dfs:
@@ -63,29 +100,33 @@ for df in cp_csv_dfs:
 platemap_dir = pathlib.Path("./platemaps")
 platemap_dir.mkdir(parents=True, exist_ok=True)
 
-# Find all position txt files in the current directory starting with "slide" using glob
-position_files = pathlib.Path().resolve().glob('slide*')
 
-# Instantiate an empty list to append platemaps to
-platemap_dfs = []
+def process_platemap_file(file: pathlib.Path) -> pd.DataFrame:
+    """
+    Reduce a position file to one row per well and save it as a platemap CSV.
 
-# Iterate through each file to update and reduce the rows to one per well
-for file in position_files:
-    # Read the CSV file
-    df = pd.read_csv(file, delimiter='\t', encoding='utf-16')
-    
-    # Only keep relevant columns to perturbation and cell line
-    df = df[['Well', 'CellLine', 'Condition']]
-    
-    # Reduce rows down to one per well
-    df = df.drop_duplicates(subset='Well')
+    Args:
+        file (pathlib.Path): path to the position file that was parsed when generating the CellProfiler CSVs
+
+    Returns:
+        pd.DataFrame: the platemap data frame with one row per well
+    """
+    # Only keep relevant columns to perturbation and cell line from the already parsed position file
+    # and reduce rows down to one per well
+    df = parsed_position_dfs[file.stem][['Well', 'CellLine', 'Condition']].drop_duplicates(
+        subset='Well', ignore_index=True
+    )
     
     # Save the processed DataFrame to the platemap directory
     output_file = pathlib.Path(f"{platemap_dir}/{file.stem.split('.')[0]}_platemap.csv")
     df.to_csv(output_file, index=False)
-    
-    # Append the processed DataFrame to the list
-    platemap_dfs.append(df)
+
+    return df
+
+
+# Process the position files concurrently to generate the platemaps
+with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+    platemap_dfs = list(executor.map(process_platemap_file, position_files))
 
 # Print the list of dataframes to verify that the process worked
 for df in platemap_dfs:
@@ -17,9 +17,14 @@
 
 
 import pathlib
+from typing import Optional, Tuple
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 
-from scipy.stats import zscore
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -32,6 +37,9 @@ import seaborn as sns
 # Set the threshold for identifying outliers with z-scoring for all metrics (# of standard deviations away from mean)
 threshold_z = 2
 
+# Define the channel of interest
+channel = "DAPI"
+
 # Directory for figures to be outputted
 figure_dir = pathlib.Path("./qc_figures")
 figure_dir.mkdir(exist_ok=True)
@@ -39,18 +47,35 @@ figure_dir.mkdir(exist_ok=True)
 # Directory containing the QC results
 qc_results_dir = pathlib.Path("./qc_results")
 
-# List to store DataFrames
-dfs = []
-
-# Iterate over each folder in qc_results and read the Image.csv file
-for folder in qc_results_dir.iterdir():
-    image_csv_path = folder / "Image.csv"
-    if image_csv_path.exists():
-        df = pd.read_csv(image_csv_path)
-        dfs.append(df)
-
-# Concatenate all DataFrames into a single DataFrame
-qc_df = pd.concat(dfs, ignore_index=True)
+# Collect the Image.csv file from each folder in qc_results
+qc_csv_paths = [str(path) for path in qc_results_dir.glob("*/Image.csv")]
+
+# Only load the metadata columns and the blur and saturation metrics for the channel of interest
+qc_metric_columns = [
+    f"ImageQuality_PowerLogLogSlope_{channel}",
+    f"ImageQuality_PercentMaximal_{channel}",
+]
+
+# Read all Image.csv files as one dataset (parsed in parallel by pyarrow), setting the metrics as floats since the column
+# types are otherwise inferred from the first file only and can be different in other plates (e.g., all whole numbers)
+qc_dataset = ds.dataset(
+    qc_csv_paths,
+    format=ds.CsvFileFormat(
+        convert_options=pacsv.ConvertOptions(
+            column_types={metric: pa.float64() for metric in qc_metric_columns}
+        )
+    ),
+)
+qc_columns = [
+    col
+    for col in qc_dataset.schema.names
+    if "Metadata_" in col or col in qc_metric_columns
+]
+
+# Convert the projected dataset into a single DataFrame, releasing the Arrow buffers as they are converted
+qc_df = qc_dataset.to_table(columns=qc_columns).to_pandas(
+    split_blocks=True, self_destruct=True
+)
 
 print(qc_df.shape)
 qc_df.head()
@@ -61,10 +86,8 @@ qc_df.head()
 # In[3]:
 
 
-# Define the channel of interest
-channel = "DAPI"
-
 # Create a DataFrame for the channel with all Metadata columns (excluding Series and Frame)
+# and add the ImageQuality columns and a "Channel" column for the channel
 df = (
     qc_df.filter(like="Metadata_")
     .drop(columns=[
@@ -73,16 +96,13 @@ df = (
         "Metadata_Channel",
         "Metadata_FileLocation",
     ])
-    .copy()
+    .assign(
+        ImageQuality_PowerLogLogSlope=qc_df[f"ImageQuality_PowerLogLogSlope_{channel}"].values,
+        ImageQuality_PercentMaximal=qc_df[f"ImageQuality_PercentMaximal_{channel}"].values,
+        Channel=channel,
+    )
 )
 
-# Add ImageQuality columns for the channel
-df[f"ImageQuality_PowerLogLogSlope"] = qc_df[f"ImageQuality_PowerLogLogSlope_{channel}"]
-df[f"ImageQuality_PercentMaximal"] = qc_df[f"ImageQuality_PercentMaximal_{channel}"]
-
-# Add "Channel" column
-df["Channel"] = channel
-
 print(df.shape)
 df.head()
 
@@ -115,11 +135,40 @@ print(summary_statistics)
 # In[6]:
 
 
-# Calculate Z-scores for the column
-z_scores = zscore(df['ImageQuality_PowerLogLogSlope'])
+def zscore_outliers(
+    values: pd.Series, lo: Optional[float] = None, hi: Optional[float] = None
+) -> Tuple[np.ndarray, float]:
+    """
+    Find outliers in a column using z-scores computed from a single mean and standard deviation.
+
+    Args:
+        values (pd.Series): column of values to z-score
+        lo (Optional[float]): flag values with a z-score below this threshold
+        hi (Optional[float]): flag values with a z-score above this threshold
+
+    Returns:
+        Tuple[np.ndarray, float]: boolean mask of outlier rows and the threshold in the units of the column
+    """
+    # Use numpy on the underlying values (skipping missing values like pandas does)
+    array = values.to_numpy(dtype=float)
+    mean_value = np.nanmean(array)
+    std_dev = np.nanstd(array, ddof=1)
+    z_scores = (array - mean_value) / std_dev
+
+    mask = np.ones_like(z_scores, dtype=bool)
+    if lo is not None:
+        mask &= z_scores < lo
+    if hi is not None:
+        mask &= z_scores > hi
+
+    return mask, mean_value + (lo if lo is not None else hi) * std_dev
+
 
 # Identify outlier rows based on Z-scores below the mean since we are looking for the blurriest images (more negative)
-blur_outliers = df[z_scores < -3]
+blur_outlier_mask, threshold_value_below_mean = zscore_outliers(
+    df["ImageQuality_PowerLogLogSlope"], lo=-3
+)
+blur_outliers = df.iloc[np.flatnonzero(blur_outlier_mask)]
 
 print(blur_outliers.shape)
 print(blur_outliers['Channel'].value_counts())
@@ -129,14 +178,7 @@ blur_outliers.sort_values(by='ImageQuality_PowerLogLogSlope', ascending=False)
 # In[7]:
 
 
-# Calculate the mean and standard deviation
-mean_value = df["ImageQuality_PowerLogLogSlope"].mean()
-std_dev = df["ImageQuality_PowerLogLogSlope"].std()
-
-# Calculate the threshold values
-threshold_value_below_mean = mean_value + -3 * std_dev
-
-# Print the calculated threshold values
+# Print the threshold value calculated alongside the outliers
 print("Threshold for outliers below the mean:", threshold_value_below_mean)
 
 
@@ -174,11 +216,11 @@ plt.show()
 # In[10]:
 
 
-# Calculate Z-scores for the column
-z_scores = zscore(df['ImageQuality_PercentMaximal'])
-
 # Identify outlier rows based on Z-scores greater than as to identify whole images with abnormally high saturated pixels
-sat_outliers = df[z_scores > 2]
+sat_outlier_mask, threshold_value_above_mean = zscore_outliers(
+    df["ImageQuality_PercentMaximal"], hi=2
+)
+sat_outliers = df.iloc[np.flatnonzero(sat_outlier_mask)]
 
 print(sat_outliers.shape)
 print(sat_outliers['Channel'].value_counts())
@@ -188,13 +230,6 @@ sat_outliers.sort_values(by='ImageQuality_PercentMaximal', ascending=True).head(
 # In[11]:
 
 
-# Calculate the mean and standard deviation
-mean_value = df["ImageQuality_PercentMaximal"].mean()
-std_dev = df["ImageQuality_PercentMaximal"].std()
-
-# Calculate the threshold values
-threshold_value_above_mean = mean_value + 2 * std_dev
-
-# Print the calculated threshold values
+# Print the threshold value calculated alongside the outliers
 print("Threshold for outliers above the mean:", threshold_value_above_mean)
 
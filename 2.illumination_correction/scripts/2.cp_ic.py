@@ -41,12 +41,15 @@ output_dir.mkdir(exist_ok=True)
 # directory where images are located within folders
 images_dir = pathlib.Path("../1.max_projection/max_projected_images")
 
+# map plate names to the folders that contain image data from that plate in a single pass through the images directory
+plate_paths = {
+    file_path.stem: file_path.resolve(strict=True)
+    for file_path in images_dir.iterdir()
+    if file_path.stem.startswith("slide")
+}
+
 # list for plate names based on folders to use to create dictionary
-plate_names = []
-# iterate through images directory and append plate names from folder names that contain image data from that plate
-for file_path in images_dir.iterdir():
-    if str(file_path.stem).startswith("slide"):
-        plate_names.append(str(file_path.stem))
+plate_names = list(plate_paths)
 
 print(plate_names)
 
@@ -59,13 +62,11 @@ print(plate_names)
 # create plate info dictionary with all parts of the CellProfiler CLI command to run in parallel
 plate_info_dictionary = {
     name: {
-        "path_to_images": pathlib.Path(list(images_dir.rglob(name))[0]).resolve(
-            strict=True
-        ),
+        "path_to_images": path,
         "path_to_output": pathlib.Path(f"{output_dir}/{name}"),
         "path_to_pipeline": path_to_pipeline,
     }
-    for name in plate_names
+    for name, path in plate_paths.items()
 }
 
 # view the dictionary to assess that all info is added correctly
@@ -9,9 +9,10 @@
 
 
 import logging
+import os
 import pathlib
-
-import pandas as pd
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 # cytotable will merge objects from SQLite file into single cells and save as parquet file
 from cytotable import convert, presets
@@ -19,6 +20,9 @@ from cytotable import convert, presets
 # Set the logging level to a higher level to avoid outputting unnecessary errors from config file in convert function
 logging.getLogger().setLevel(logging.ERROR)
 
+sys.path.append("../utils")
+import split_profiles
+
 
 # ## Set paths and variables
 
@@ -106,51 +110,42 @@ unwanted_list_path = pathlib.Path("./unwanted_image_cols.txt")
 with open(unwanted_list_path, "r") as file:
     columns_to_remove = [line.strip() for line in file]
 
-# Iterate through directory with converted outputs
-for plate_folder in parquet_dir.iterdir():
-    # Only process the files that are in the plate names list
-    if plate_folder.name in plate_names:
-        # Read in each file as data frame
-        plate_df = pd.read_parquet(
-            pathlib.Path(f"{plate_folder}/{plate_folder.stem}_converted.parquet")
-        )
-        print(
-            "Starting to edit image and nuclei data frames for plate:",
-            plate_folder.stem,
+# Identify metadata columns for nuclei data frame
+metadata_columns = [
+    "Metadata_ImageNumber",
+    "Image_Metadata_Plate",
+    "Image_Metadata_Site",
+    "Image_Metadata_Well",
+    "Image_Count_Nuclei",
+    "Image_FileName_DAPI"
+]
+
+# Only process the folders with converted outputs that are in the plate names list
+plate_folders = [
+    plate_folder
+    for plate_folder in parquet_dir.iterdir()
+    if plate_folder.name in plate_names
+]
+
+# Split the image and nuclei data for each plate in parallel since each plate is independent
+with ProcessPoolExecutor(
+    max_workers=max(1, min(len(plate_folders), os.cpu_count()))
+) as executor:
+    futures = {
+        plate_folder.stem: executor.submit(
+            split_profiles.split_plate_profiles,
+            plate_folder=plate_folder,
+            columns_to_remove=columns_to_remove,
+            metadata_columns=metadata_columns,
         )
+        for plate_folder in plate_folders
+    }
+
+    for plate, future in futures.items():
+        nuclei_shape, image_shape = future.result()
 
-        # Drop the specified columns (ignore error if a column isn't there)
-        plate_df = plate_df.drop(columns=columns_to_remove, errors="ignore")
-
-        # Identify metadata columns for nuclei data frame
-        metadata_columns = [
-            "Metadata_ImageNumber",
-            "Image_Metadata_Plate",
-            "Image_Metadata_Site",
-            "Image_Metadata_Well",
-            "Image_Count_Nuclei",
-            "Image_FileName_DAPI"
-        ]
-
-        # Create nuclei (single-cell) data frame
-        nuclei_df = plate_df[
-            metadata_columns
-            + [col for col in plate_df.columns if col.startswith("Nuclei_")]
-        ]
-
-        # Create image (bulk) data frame
-        image_df = plate_df[
-            ["Metadata_ImageNumber"]
-            + [col for col in plate_df.columns if col.startswith("Image_")]
-        ]
-        # Drop duplicate images in the image data frame since each image will have the same values even if the row is repeated
-        image_df = image_df.drop_duplicates(subset="Metadata_ImageNumber")
-
-        # Save nuclei and image data frames to the same folder as the plate
-        nuclei_df.to_parquet(f"{plate_folder}/per_nuclei.parquet", index=False)
-        image_df.to_parquet(f"{plate_folder}/per_image.parquet", index=False)
-
-        # nuclei_df and image_df shape and one data frame to assess all looks correct
-        print("Shape of nuclei data frame", nuclei_df.shape)
-        print("Shape of image data frame", image_df.shape)
+        # nuclei and image data shape to assess all looks correct
+        print("Image and nuclei data frames have been saved for plate:", plate)
+        print("Shape of nuclei data frame", nuclei_shape)
+        print("Shape of image data frame", image_shape)
 
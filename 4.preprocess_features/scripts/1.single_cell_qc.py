@@ -3,7 +3,7 @@
 
 # # Perform single-cell quality control
 # 
-# In this notebook, we perform single-cell quality control using coSMicQC.
+# In this notebook, we perform single-cell quality control using the same z-score method as coSMicQC.
 # To filter the single-cells, the default method is z-score to find outliers using the values from only one feature at a time. 
 # We use features from the AreaShape module to assess the quality of the segmented single-cells:
 # 
@@ -34,13 +34,14 @@
 
 import pathlib
 
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 
-import cosmicqc as cosm
-
 
 # ## Set paths and variables
 
@@ -75,6 +76,13 @@ metadata_columns = [
     "Image_FileName_DAPI"
 ]
 
+# AreaShape features used to find single-cells failing QC
+qc_features = [
+    "Nuclei_AreaShape_Area",
+    "Nuclei_AreaShape_FormFactor",
+    "Nuclei_AreaShape_Eccentricity",
+]
+
 # Get a list of the plates to be used for single-cell QC
 plates = [plate.name.split("_")[0] for plate in data_dir.iterdir() if plate.is_dir()]
 
@@ -89,25 +97,32 @@ for plate in plates:
 # In[3]:
 
 
-# Create an empty list to store data frames for each plate
-all_plate_dfs = []
-
-# Iterate through each plate and create the specified data frame
-for plate in plates:
-    # Only process the files that are in the plate names list
-    plate_path = pathlib.Path(f"{data_dir}/{plate}/per_nuclei.parquet")
-
-    # Read the parquet file into a DataFrame
-    qc_df = pd.read_parquet(plate_path)
-
-    # Append the data frame to the list
-    all_plate_dfs.append(qc_df)
-
-# Concatenate data frames for each plate
-concat_df = pd.concat(all_plate_dfs)
+# Paths to the nuclei parquet file for each plate
+plate_paths = [pathlib.Path(f"{data_dir}/{plate}/per_nuclei.parquet") for plate in plates]
+
+# Make sure the metadata and QC features are in each parquet file before reading and keep track of the number of rows per plate
+plate_num_rows = []
+for plate, plate_path in zip(plates, plate_paths):
+    plate_file = pq.ParquetFile(plate_path)
+    missing_columns = set(metadata_columns + qc_features) - set(
+        plate_file.schema_arrow.names
+    )
+    if missing_columns:
+        raise ValueError(
+            f"The columns {sorted(missing_columns)} are not in '{plate_path.name}' for {plate}"
+        )
+    plate_num_rows.append(plate_file.metadata.num_rows)
+
+# Read only the metadata and QC feature columns from all plates as one dataset into a single data frame
+# (the index is continuous across plates and the rows are in the same order as the plate files so it doesn't cause issues downstream)
+concat_df = (
+    ds.dataset([str(plate_path) for plate_path in plate_paths], format="parquet")
+    .to_table(columns=metadata_columns + qc_features)
+    .to_pandas(self_destruct=True, split_blocks=True, use_threads=True)
+)
 
-# Reset the index so that the index doesn't reset per plate and cause issues downstream
-concat_df.reset_index(drop=True, inplace=True)
+# Convert the repeated plate names to categorical since they are used as the hue when plotting the distributions below
+concat_df["Image_Metadata_Plate"] = concat_df["Image_Metadata_Plate"].astype("category")
 
 print(concat_df.shape)
 concat_df.head()
@@ -127,24 +142,30 @@ fig, axes = plt.subplots(1, 3, figsize=(18, 6)) # first is width and second is h
 # Flatten the axes array for easy indexing
 axes = axes.flatten()
 
-# Create kdeplot for Nuclei_AreaShape_Area
-sns.kdeplot(
+# Create density histogram for Nuclei_AreaShape_Area
+sns.histplot(
     data=concat_df,
     x="Nuclei_AreaShape_Area",
     hue="Image_Metadata_Plate",
     palette="viridis",
+    bins=200,
+    stat="density",
+    element="step",
     fill=True,
     common_norm=False,
     ax=axes[0],  # Set the first subplot
 )
 axes[0].set_title("Area")
 
-# Create kdeplot for FormFactor
-sns.kdeplot(
+# Create density histogram for FormFactor
+sns.histplot(
     data=concat_df,
     x="Nuclei_AreaShape_FormFactor",
     hue="Image_Metadata_Plate",
     palette="viridis",
+    bins=200,
+    stat="density",
+    element="step",
     fill=True,
     common_norm=False,
     ax=axes[1],
@@ -152,12 +173,15 @@ sns.kdeplot(
 )
 axes[1].set_title("Form Factor")
 
-# Create kdeplot for Eccentricity
-sns.kdeplot(
+# Create density histogram for Eccentricity
+sns.histplot(
     data=concat_df,
     x="Nuclei_AreaShape_Eccentricity",
     hue="Image_Metadata_Plate",
     palette="viridis",
+    bins=200,
+    stat="density",
+    element="step",
     fill=True,
     common_norm=False,
     ax=axes[2],
@@ -184,6 +208,79 @@ plt.show()
 # In[5]:
 
 
+def calculate_zscores(feature_values: dict, features: list) -> dict:
+    """
+    Calculate the z-scores for a set of features in a condition using the same method as coSMicQC, where single-cells
+    missing any of the features are dropped and then z-scores use the population standard deviation.
+
+    Args:
+        feature_values (dict): feature names with the array of values for each single-cell
+        features (list): features to calculate the z-scores for together
+
+    Returns:
+        dict: feature names with the array of z-scores for each single-cell (NaN for dropped single-cells)
+    """
+    valid_mask = np.logical_and.reduce([~np.isnan(feature_values[feature]) for feature in features])
+
+    zscores = {}
+    for feature in features:
+        valid_values = feature_values[feature][valid_mask]
+        zscores[feature] = np.full(valid_mask.size, np.nan)
+        zscores[feature][valid_mask] = (valid_values - valid_values.mean()) / valid_values.std()
+
+    return zscores
+
+
+def find_outliers_mask(
+    zscores: dict, feature_values: dict, feature_thresholds: dict
+) -> np.ndarray:
+    """
+    Find the single-cells that are outliers for all of the given feature thresholds using precomputed z-scores.
+
+    Args:
+        zscores (dict): feature names with the array of z-scores for each single-cell (from calculate_zscores)
+        feature_values (dict): feature names with the array of values for each single-cell
+        feature_thresholds (dict): feature names with their z-score thresholds, where a positive threshold finds outliers
+        above the mean and a negative threshold finds outliers below the mean
+
+    Returns:
+        np.ndarray: boolean mask of the outlier single-cells (dropped single-cells are never outliers)
+    """
+    outliers_mask = np.logical_and.reduce(
+        [
+            zscores[feature] > threshold if threshold > 0 else zscores[feature] < threshold
+            for feature, threshold in feature_thresholds.items()
+        ]
+    )
+
+    # Print summary statistics about the outliers found
+    num_outliers = outliers_mask.sum()
+    num_valid = (~np.isnan(zscores[next(iter(feature_thresholds))])).sum()
+    print(
+        "Number of outliers:",
+        num_outliers,
+        f"({'{:.2f}'.format((num_outliers / num_valid) * 100)}%)",
+    )
+    print("Outliers Range:")
+    for feature in feature_thresholds:
+        outlier_values = feature_values[feature][outliers_mask]
+        print(f"{feature} Min:", outlier_values.min())
+        print(f"{feature} Max:", outlier_values.max())
+
+    return outliers_mask
+
+
+# Calculate the z-scores once per set of features used in the conditions below, so both area and formfactor conditions
+# share the same z-scores
+qc_feature_values = dict(zip(qc_features, concat_df[qc_features].to_numpy(dtype=float).T))
+area_formfactor_zscores = calculate_zscores(
+    qc_feature_values, ["Nuclei_AreaShape_Area", "Nuclei_AreaShape_FormFactor"]
+)
+eccentricity_zscores = calculate_zscores(
+    qc_feature_values, ["Nuclei_AreaShape_Eccentricity"]
+)
+
+
 # Set a negative threshold to identify both outlier small nuclei and low formfactor representing poor segmentations
 outlier_threshold = -1
 
@@ -193,11 +290,13 @@ feature_thresholds = {
     "Nuclei_AreaShape_FormFactor": outlier_threshold,
 }
 
-small_low_formfactor_outliers = cosm.find_outliers(
-    df=concat_df,
-    metadata_columns=metadata_columns,
-    feature_thresholds=feature_thresholds
+small_low_formfactor_mask = find_outliers_mask(
+    area_formfactor_zscores, qc_feature_values, feature_thresholds
 )
+small_low_formfactor_outliers = concat_df.loc[
+    small_low_formfactor_mask,
+    list(feature_thresholds) + metadata_columns,
+]
 
 small_low_formfactor_outliers.sort_values(by="Nuclei_AreaShape_Area", ascending=True).head()
 
@@ -211,11 +310,13 @@ small_low_formfactor_outliers.sort_values(by="Nuclei_AreaShape_Area", ascending=
 feature_thresholds = {"Nuclei_AreaShape_Area": 2, "Nuclei_AreaShape_FormFactor": -1}
 
 # run function to identify outliers given conditions
-large_area_formfactor_outliers_df = cosm.find_outliers(
-    df=concat_df,
-    metadata_columns=metadata_columns,
-    feature_thresholds=feature_thresholds
+large_area_formfactor_mask = find_outliers_mask(
+    area_formfactor_zscores, qc_feature_values, feature_thresholds
 )
+large_area_formfactor_outliers_df = concat_df.loc[
+    large_area_formfactor_mask,
+    list(feature_thresholds) + metadata_columns,
+]
 
 # print out data frame
 large_area_formfactor_outliers_df.sort_values(by="Nuclei_AreaShape_Area", ascending=False).head()
@@ -250,20 +351,10 @@ plt.show()
 # In[8]:
 
 
-# Reset the default value to 'inlier'
-concat_df["Outlier_Status"] = 0
-
-# Update the 'Outlier_Status' column based on the outliers DataFrame using index
-concat_df.loc[concat_df.index.isin(small_low_formfactor_outliers.index), "Outlier_Status"] = (
-    1
-)
-
-# Update the 'Outlier_Status' column based on the outliers DataFrame using index
-concat_df.loc[concat_df.index.isin(large_area_formfactor_outliers_df.index), "Outlier_Status"] = (
-    1
-)
-# Ensure 'Outlier_Status' is numeric
-concat_df['Outlier_Status'] = pd.to_numeric(concat_df['Outlier_Status'], errors='coerce')
+# Set the 'Outlier_Status' column to 1 for single-cells in either outlier condition and 0 for inliers (already numeric as int8)
+concat_df["Outlier_Status"] = (
+    small_low_formfactor_mask | large_area_formfactor_mask
+).astype(np.int8)
 
 # Define a custom colormap
 cmap = mcolors.ListedColormap(['#006400', '#990090'])
@@ -300,11 +391,13 @@ feature_thresholds = {
 }
 
 # run function to identify outliers given conditions
-eccent_outliers_df = cosm.find_outliers(
-    df=concat_df,
-    metadata_columns=metadata_columns,
-    feature_thresholds=feature_thresholds
+eccent_mask = find_outliers_mask(
+    eccentricity_zscores, qc_feature_values, feature_thresholds
 )
+eccent_outliers_df = concat_df.loc[
+    eccent_mask,
+    list(feature_thresholds) + metadata_columns,
+]
 
 # print out data frame
 eccent_outliers_df.head()
@@ -359,12 +452,12 @@ plt.show()
 
 # ## Combine all combinations of outlier data frames together to make one nuclei outlier data frame
 
-# ### Concat on common columns to make one nuclei outlier data frame
+# ### Select the outliers from all conditions on common columns to make one nuclei outlier data frame
 
 # In[11]:
 
 
-# Concat all outlier data frames together on common columns to make one nuclei outliers data frame
+# Select single-cells that failed any condition once on common columns to make one nuclei outliers data frame
 common_columns = [
     "Image_Metadata_Plate",
     "Image_Metadata_Well",
@@ -373,13 +466,9 @@ common_columns = [
     "Nuclei_Location_Center_Y",
 ]
 
-nuclei_outliers_df = pd.concat(
-    [
-        small_low_formfactor_outliers[common_columns],
-        large_area_formfactor_outliers_df[common_columns],
-        eccent_outliers_df[common_columns],
-    ]
-)
+# Combine the outlier masks so each single-cell is only included once (no duplicates to drop)
+outlier_mask = small_low_formfactor_mask | large_area_formfactor_mask | eccent_mask
+nuclei_outliers_df = concat_df.loc[outlier_mask, common_columns].copy()
 
 # Define column names to be added
 columns_to_add = [
@@ -388,28 +477,16 @@ columns_to_add = [
     "Eccentricity_Failed",
 ]
 
-# Iterate over each column name
-for column_name in columns_to_add:
-    # Assign 1 to rows where the column exists in the corresponding dataframe, else 0
-    nuclei_outliers_df[column_name] = 0
-    nuclei_outliers_df.loc[
-        nuclei_outliers_df.index.isin(small_low_formfactor_outliers.index)
-        & (column_name == "Small_Area_FormFactor_Failed"),
-        column_name,
-    ] = 1
-    nuclei_outliers_df.loc[
-        nuclei_outliers_df.index.isin(large_area_formfactor_outliers_df.index)
-        & (column_name == "Large_Area_FormFactor_Failed"),
-        column_name,
-    ] = 1
-    nuclei_outliers_df.loc[
-        nuclei_outliers_df.index.isin(eccent_outliers_df.index)
-        & (column_name == "Eccentricity_Failed"),
-        column_name,
-    ] = 1
-
-# drop any duplicates based on index
-nuclei_outliers_df = nuclei_outliers_df.drop_duplicates(subset=None)
+# Assign 1 to rows that failed the corresponding condition, else 0, by taking the outlier masks at the index
+# (the index of concat_df is the row position)
+outlier_index = nuclei_outliers_df.index.values
+nuclei_outliers_df["Small_Area_FormFactor_Failed"] = small_low_formfactor_mask[
+    outlier_index
+].astype(np.int8)
+nuclei_outliers_df["Large_Area_FormFactor_Failed"] = large_area_formfactor_mask[
+    outlier_index
+].astype(np.int8)
+nuclei_outliers_df["Eccentricity_Failed"] = eccent_mask[outlier_index].astype(np.int8)
 
 print(nuclei_outliers_df.shape)
 nuclei_outliers_df.head()
@@ -478,35 +555,31 @@ concat_df[
 # In[14]:
 
 
-# Identify failing QC single-cells based on index values
-outlier_indices = nuclei_outliers_df.index
+# Use the combined outlier mask from all conditions as one mask of single-cells passing QC, split per plate since the rows
+# of concat_df are in the same order as the plate files that are read again with all features to be saved
+keep_mask = ~outlier_mask
+plate_keep_masks = np.split(keep_mask, np.cumsum(plate_num_rows)[:-1])
 
-# Remove rows with outlier indices (identified above) from the concat data frame
-concat_df_cleaned = concat_df.drop(outlier_indices)
+# Keep track of the number of single-cells removed during cleaning
+num_indices_removed = 0
 
-# Remove columns from z-scoring or assigning outliers (not included for downstream analysis)
-columns_to_keep = [
-    col
-    for col in concat_df_cleaned.columns
-    if not col.startswith("Z_Score") and col != "Outlier_Status"
-]
+# Save cleaned data for each plate and show the number of single-cells removed per plate
+for plate, plate_path, plate_keep_mask in zip(plates, plate_paths, plate_keep_masks):
+    # Read all columns for the plate as an Arrow table (the full plate is never converted to pandas)
+    plate_table = pq.read_table(plate_path)
 
-# Filter columns based on conditions
-concat_df_cleaned = concat_df_cleaned[columns_to_keep]
+    # Remove rows for single-cells failing QC (identified above) from the plate table
+    plate_table = plate_table.filter(pa.array(plate_keep_mask))
 
-# Get the number of indices removed during cleaning
-num_indices_removed = len(concat_df.index) - len(concat_df_cleaned.index)
+    num_removed_per_plate = int(plate_keep_mask.size - plate_keep_mask.sum())
+    num_indices_removed += num_removed_per_plate
 
-# Save cleaned data for each plate and show the number of single-cells removed per plate
-for plate, plate_df in concat_df_cleaned.groupby("Image_Metadata_Plate"):
-    num_removed_per_plate = len(
-        concat_df[concat_df["Image_Metadata_Plate"] == plate]
-    ) - len(plate_df)
-    plate_df.to_parquet(f"{cleaned_dir}/{plate}_sc_cleaned.parquet")
+    # Write the cleaned plate directly from the Arrow table
+    pq.write_table(plate_table, f"{cleaned_dir}/{plate}_sc_cleaned.parquet")
     print(f"Plate {plate}: Number of single-cells dropped: {num_removed_per_plate}")
 
 # Verify the result
 print(f"Number of single-cells dropped: {num_indices_removed}")
-print(plate_df.shape)
-plate_df.head()
+print(plate_table.shape)
+plate_table.slice(0, 5).to_pandas()
 
@@ -10,11 +10,16 @@
 # In[1]:
 
 
+import os
 import pathlib
 import pprint
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
-from pycytominer import annotate, normalize, feature_select
+
+sys.path.append("../utils")
+import pycytominer_pipeline
 
 
 # ## Set paths and variables
@@ -75,68 +80,28 @@ pprint.pprint(plate_info_dictionary, indent=4)
 # In[4]:
 
 
-for plate, info in plate_info_dictionary.items():
-    print(f"Performing pycytominer pipeline for {plate}")
-    # Set output paths per preprocessing step
-    output_annotated_file = str(
-        pathlib.Path(f"{output_dir}/{plate}_sc_annotated.parquet")
-    )
-    output_normalized_file = str(
-        pathlib.Path(f"{output_dir}/{plate}_sc_normalized.parquet")
-    )
-    output_feature_select_file = str(
-        pathlib.Path(f"{output_dir}/{plate}_sc_feature_selected.parquet")
-    )
-
-    # Load in the converted profile to be used in the first step
-    profile_df = pd.read_parquet(info["profile_path"])
-
-    # Load in platemap file with most relevant columns for annotation
-    platemap_df = pd.read_csv(info["platemap_path"], usecols=["Well", "CellLine", "Condition"])
-
-    # Step 1: Annotation
-    annotate(
-        profiles=profile_df,
-        platemap=platemap_df,
-        join_on=["Metadata_Well", "Image_Metadata_Well"],
-        output_file=output_annotated_file,
-        output_type="parquet",
-    )
-
-    # Load the annotated parquet file to fix metadata columns names
-    annotated_df = pd.read_parquet(output_annotated_file)
-
-    # Rename columns using the rename() function
-    column_name_mapping = {
-        "Image_Metadata_Site": "Metadata_Site",
-        "Image_Count_Nuclei": "Metadata_Nuclei_Site_Count",
-        "Nuclei_Location_Center_X": "Metadata_Nuclei_Location_Center_X",
-        "Nuclei_Location_Center_Y": "Metadata_Nuclei_Location_Center_Y",
+# Run the pycytominer pipeline for each plate in parallel since each plate is independent
+# (half of the CPUs are used since pycytominer and pandas already use multiple threads)
+with ProcessPoolExecutor(
+    max_workers=max(1, min(len(plate_info_dictionary), os.cpu_count() // 2))
+) as executor:
+    futures = {
+        plate: executor.submit(
+            pycytominer_pipeline.run_pycytominer_pipeline,
+            plate=plate,
+            profile_path=info["profile_path"],
+            platemap_path=info["platemap_path"],
+            output_dir=output_dir,
+            feature_select_ops=feature_select_ops,
+        )
+        for plate, info in plate_info_dictionary.items()
     }
 
-    annotated_df.rename(columns=column_name_mapping, inplace=True)
-
-    # Save the modified DataFrame back to the same location
-    annotated_df.to_parquet(output_annotated_file, index=False)
-
-    # Step 2: Normalization
-    normalized_df = normalize(
-        profiles=output_annotated_file,
-        method="standardize",
-        output_file=output_normalized_file,
-        output_type="parquet",
-    )
-
-    # Step 3: Feature selection
-    feature_select(
-        output_normalized_file,
-        operation=feature_select_ops,
-        output_file=output_feature_select_file,
-        output_type="parquet",
-    )
-    print(
-        f"Annotation, normalization, and feature selection have been performed for {plate}"
-    )
+    for plate, future in futures.items():
+        future.result()
+        print(
+            f"Annotation, normalization, and feature selection have been performed for {plate}"
+        )
 
 
 # ## Check example output file to confirm that the process worked
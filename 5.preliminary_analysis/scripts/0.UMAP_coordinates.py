@@ -8,13 +8,18 @@
 # In[1]:
 
 
-import glob
+import os
 import pathlib
-import pandas as pd
-import umap
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-from pycytominer import feature_select
-from pycytominer.cyto_utils import infer_cp_features
+import pyarrow.parquet as pq
+
+# Limit the numba threads used by each UMAP fit (must be set before UMAP is imported)
+os.environ["NUMBA_NUM_THREADS"] = "2"
+
+sys.path.append("../utils")
+import umap_embeddings
 
 
 # ## Set constants
@@ -42,19 +47,19 @@ data_dir = pathlib.Path("../4.preprocess_features/data/single_cell_profiles")
 file_suffix = "*sc_feature_selected.parquet"
 
 # Obtain file paths for all feature selected plates
-fs_files = glob.glob(f"{data_dir}/{file_suffix}")
+fs_files = sorted(data_dir.glob(file_suffix))
 fs_files
 
 
 # In[4]:
 
 
-# Load feature data into a dictionary, keyed on plate name
-cp_dfs = {x.split("/")[-1]: pd.read_parquet(x) for x in fs_files}
+# Load feature data parquet metadata into a dictionary, keyed on plate name (each plate is loaded when it is fit)
+cp_metadata = {file_path.stem: pq.read_metadata(file_path) for file_path in fs_files}
 
 # Print out useful information about each dataset
-print(cp_dfs.keys())
-[cp_dfs[x].shape for x in cp_dfs]
+print(cp_metadata.keys())
+[(cp_metadata[x].num_rows, cp_metadata[x].num_columns) for x in cp_metadata]
 
 
 # ## Generate UMAP coordinates for each plate
@@ -75,44 +80,26 @@ desired_columns = [
     "Metadata_Nuclei_Location_Center_Y"
 ]
 
-# Fit UMAP features per dataset and save
-for plate in cp_dfs:
-    plate_name = pathlib.Path(plate).stem
-    print("UMAP embeddings being generated for", plate_name)
-
-    # Make sure to reinitialize UMAP instance per plate
-    umap_fit = umap.UMAP(random_state=umap_random_seed, n_components=umap_n_components)
-
-    # Make sure NA columns have been removed
-    cp_df = cp_dfs[plate]
-    cp_df = feature_select(cp_df, operation="drop_na_columns", na_cutoff=0)
-
-    # Process cp_df to separate features and metadata
-    cp_features = infer_cp_features(cp_df)
-    meta_features = infer_cp_features(cp_df, metadata=True)
-    filtered_meta_features = [
-        feature for feature in meta_features if feature in desired_columns
+# Leave two numba threads for each UMAP fit so that parallel plate fits do not oversubscribe the CPUs
+num_workers = max(1, min(len(fs_files), os.cpu_count() // 2))
+
+# Fit UMAP features per dataset in parallel and save
+with ProcessPoolExecutor(max_workers=num_workers) as executor:
+    futures = [
+        executor.submit(
+            umap_embeddings.generate_umap_embeddings,
+            plate_path=plate_path,
+            output_dir=output_dir,
+            desired_columns=desired_columns,
+            umap_random_seed=umap_random_seed,
+            umap_n_components=umap_n_components,
+        )
+        for plate_path in fs_files
     ]
+    umap_dfs = dict(future.result() for future in futures)
 
-    # Fit UMAP and convert to pandas DataFrame
-    embeddings = pd.DataFrame(
-        umap_fit.fit_transform(cp_df.loc[:, cp_features]),
-        columns=[f"UMAP{x}" for x in range(0, umap_n_components)],
-    )
-    print(embeddings.shape)
-
-    # Combine with metadata
-    cp_umap_with_metadata_df = pd.concat(
-        [cp_df.loc[:, filtered_meta_features].reset_index(drop=True), embeddings],
-        axis=1,
-    )
-
-    # randomize the rows of the dataframe to plot the order of the data evenly
-    cp_umap_with_metadata_df = cp_umap_with_metadata_df.sample(frac=1, random_state=0)
-
-    # Generate output file and save
-    output_umap_file = pathlib.Path(output_dir, f"UMAP_{plate_name}.tsv")
-    cp_umap_with_metadata_df.to_csv(output_umap_file, index=False, sep="\t")
+# Use the last plate as the example output below
+cp_umap_with_metadata_df = umap_dfs[list(umap_dfs)[-1]]
 
 
 # In[6]:
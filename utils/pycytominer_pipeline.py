@@ -0,0 +1,94 @@
+"""
+This collection of functions runs the pycytominer preprocessing pipeline (annotation, normalization, and feature selection)
+on the single-cell profiles of one plate so that plates can be processed in parallel.
+"""
+
+import pathlib
+from typing import List
+
+import pandas as pd
+from pycytominer import annotate, feature_select, normalize
+
+
+def run_pycytominer_pipeline(
+    plate: str,
+    profile_path: str,
+    platemap_path: str,
+    output_dir: pathlib.Path,
+    feature_select_ops: List[str],
+) -> None:
+    """
+    This function performs annotation, normalization, and feature selection with pycytominer on the single-cell
+    profiles of a plate and saves the annotated and feature selected profiles as parquet files.
+
+    Args:
+        plate (str): name of the plate being processed
+        profile_path (str): path to the cleaned single-cell profiles for the plate
+        platemap_path (str): path to the platemap file for the plate
+        output_dir (pathlib.Path): directory for the annotated and feature selected files to be saved to
+        feature_select_ops (List[str]): operations to perform for feature selection
+    """
+    print(f"Performing pycytominer pipeline for {plate}")
+    # Set output paths per preprocessing step
+    output_annotated_file = str(
+        pathlib.Path(f"{output_dir}/{plate}_sc_annotated.parquet")
+    )
+    output_feature_select_file = str(
+        pathlib.Path(f"{output_dir}/{plate}_sc_feature_selected.parquet")
+    )
+
+    # Load in the converted profile to be used in the first step
+    profile_df = pd.read_parquet(profile_path)
+
+    # Load in platemap file with most relevant columns for annotation
+    platemap_df = pd.read_csv(
+        platemap_path,
+        usecols=["Well", "CellLine", "Condition"],
+        dtype={"CellLine": "category", "Condition": "category"},
+    )
+
+    # Use the same categorical type for the wells on both sides of the join so the merge uses the integer category codes
+    # (categories can not be missing, so only wells with values are used and missing wells are merged the same as before)
+    well_dtype = pd.CategoricalDtype(
+        pd.Index(platemap_df["Well"].dropna().unique()).union(
+            profile_df["Image_Metadata_Well"].dropna().unique()
+        )
+    )
+    platemap_df["Well"] = platemap_df["Well"].astype(well_dtype)
+    profile_df["Image_Metadata_Well"] = profile_df["Image_Metadata_Well"].astype(
+        well_dtype
+    )
+
+    # Step 1: Annotation (returns the annotated data frame since no output file is given)
+    annotated_df = annotate(
+        profiles=profile_df,
+        platemap=platemap_df,
+        join_on=["Metadata_Well", "Image_Metadata_Well"],
+    )
+
+    # Fix metadata columns names using the rename() function
+    column_name_mapping = {
+        "Image_Metadata_Site": "Metadata_Site",
+        "Image_Count_Nuclei": "Metadata_Nuclei_Site_Count",
+        "Nuclei_Location_Center_X": "Metadata_Nuclei_Location_Center_X",
+        "Nuclei_Location_Center_Y": "Metadata_Nuclei_Location_Center_Y",
+    }
+
+    annotated_df.rename(columns=column_name_mapping, inplace=True)
+
+    # Save the annotated DataFrame with the fixed column names once
+    annotated_df.to_parquet(output_annotated_file, index=False)
+
+    # Step 2: Normalization (kept in memory and passed directly to feature selection)
+    normalized_df = normalize(
+        profiles=annotated_df,
+        method="standardize",
+    )
+
+    # Step 3: Feature selection
+    feature_select(
+        normalized_df,
+        operation=feature_select_ops,
+        output_file=output_feature_select_file,
+        output_type="parquet",
+    )
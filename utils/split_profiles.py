@@ -0,0 +1,128 @@
+"""
+This collection of functions splits the CytoTable converted parquet file for a plate into separate nuclei (single-cell)
+and image (bulk) parquet files so that plates can be processed in parallel.
+"""
+
+import pathlib
+from typing import List, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+def split_plate_profiles(
+    plate_folder: pathlib.Path,
+    columns_to_remove: List[str],
+    metadata_columns: List[str],
+) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    This function streams the converted parquet file for a plate in batches and saves the nuclei and image data
+    as `per_nuclei.parquet` and `per_image.parquet` to the same folder as the plate.
+
+    Args:
+        plate_folder (pathlib.Path): folder with the converted parquet file for the plate
+        columns_to_remove (List[str]): columns to drop from the converted data (ignored if a column isn't there)
+        metadata_columns (List[str]): metadata columns to include in the nuclei data
+
+    Returns:
+        Tuple[Tuple[int, int], Tuple[int, int]]: shape of the nuclei data and shape of the image data
+    """
+    converted_file = pq.ParquetFile(
+        pathlib.Path(f"{plate_folder}/{plate_folder.stem}_converted.parquet")
+    )
+
+    # Read only the schema to find the columns to keep, dropping the specified columns (ignore if a column isn't there)
+    converted_schema = converted_file.schema_arrow
+    column_names = np.array(converted_schema.names, dtype=str)
+    kept_columns = column_names[~np.isin(column_names, columns_to_remove)]
+
+    # Columns for the nuclei (single-cell) and image (bulk) data, using vectorized prefix matching over the column names
+    nuclei_columns = (
+        metadata_columns
+        + kept_columns[np.char.startswith(kept_columns, "Nuclei_")].tolist()
+    )
+    image_columns = (
+        ["Metadata_ImageNumber"]
+        + kept_columns[np.char.startswith(kept_columns, "Image_")].tolist()
+    )
+    nuclei_schema = pa.schema([converted_schema.field(col) for col in nuclei_columns])
+
+    # Image numbers that have already been kept for the image data
+    seen_image_numbers = pa.array(
+        [], type=converted_schema.field("Metadata_ImageNumber").type
+    )
+    image_tables = []
+    num_nuclei_rows = 0
+
+    # Stream the converted file in batches so memory use does not scale with the plate size
+    # and save nuclei data to the same folder as the plate (one row group per batch)
+    with pq.ParquetWriter(
+        f"{plate_folder}/per_nuclei.parquet",
+        nuclei_schema,
+        compression="zstd",
+        compression_level=3,
+        use_dictionary=True,
+    ) as nuclei_writer:
+        for batch in converted_file.iter_batches(
+            batch_size=64_000,
+            columns=list(dict.fromkeys(nuclei_columns + image_columns)),
+        ):
+            batch_table = pa.Table.from_batches([batch])
+
+            # Write the nuclei (single-cell) batch directly
+            nuclei_table = batch_table.select(nuclei_columns)
+            nuclei_writer.write_table(nuclei_table, row_group_size=64_000)
+            num_nuclei_rows += nuclei_table.num_rows
+
+            # Drop duplicate images in the image batch since each image will have the same values even if the row is repeated
+            # by keeping the first row of each image number (multi-threaded hash grouping in Arrow)
+            image_table = batch_table.select(image_columns)
+            first_rows = (
+                pa.table(
+                    {
+                        "Metadata_ImageNumber": image_table["Metadata_ImageNumber"],
+                        "row_index": np.arange(image_table.num_rows),
+                    }
+                )
+                .group_by("Metadata_ImageNumber")
+                .aggregate([("row_index", "min")])["row_index_min"]
+            )
+            image_table = image_table.take(np.sort(first_rows.to_numpy()))
+
+            # Drop images that were already kept from a previous batch
+            image_table = image_table.filter(
+                pc.invert(
+                    pc.is_in(
+                        image_table["Metadata_ImageNumber"],
+                        value_set=seen_image_numbers,
+                    )
+                )
+            )
+            seen_image_numbers = pa.concat_arrays(
+                [
+                    seen_image_numbers,
+                    image_table["Metadata_ImageNumber"].combine_chunks(),
+                ]
+            )
+            image_tables.append(image_table)
+
+    # The image data only has one row per image so it is small enough to save to the same folder as the plate all at once,
+    # using smaller row groups since it is much wider than it is long (an empty table is saved if the plate has no rows)
+    if image_tables:
+        image_table = pa.concat_tables(image_tables)
+    else:
+        image_table = pa.schema(
+            [converted_schema.field(col) for col in image_columns]
+        ).empty_table()
+    pq.write_table(
+        image_table,
+        f"{plate_folder}/per_image.parquet",
+        row_group_size=8_000,
+        compression="zstd",
+        compression_level=3,
+        use_dictionary=True,
+    )
+
+    return (num_nuclei_rows, len(nuclei_columns)), image_table.shape
@@ -0,0 +1,118 @@
+"""
+This collection of functions generates UMAP coordinates from the feature selected single-cell profiles of one plate
+so that plates can be processed in parallel.
+"""
+
+import pathlib
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import umap
+from pycytominer.cyto_utils import infer_cp_features
+
+
+def generate_umap_embeddings(
+    plate_path: pathlib.Path,
+    output_dir: pathlib.Path,
+    desired_columns: List[str],
+    umap_random_seed: int,
+    umap_n_components: int,
+) -> Tuple[str, pd.DataFrame]:
+    """
+    This function fits UMAP on the feature selected profiles of a plate and saves the UMAP coordinates with the
+    metadata that is common between plates as a TSV file.
+
+    Args:
+        plate_path (pathlib.Path): path to the feature selected parquet file for the plate
+        output_dir (pathlib.Path): directory for the UMAP coordinates to be saved to
+        desired_columns (List[str]): metadata columns to include with the UMAP coordinates
+        umap_random_seed (int): random seed for UMAP
+        umap_n_components (int): number of UMAP components to generate
+
+    Returns:
+        Tuple[str, pd.DataFrame]: name of the plate and the data frame of UMAP coordinates with metadata
+    """
+    plate_name = pathlib.Path(plate_path).stem
+    print("UMAP embeddings being generated for", plate_name)
+
+    # Make sure to reinitialize UMAP instance per plate (single job per fit since plates are fit in parallel)
+    umap_fit = umap.UMAP(
+        random_state=umap_random_seed,
+        n_components=umap_n_components,
+        n_jobs=1,
+        low_memory=True,
+    )
+
+    # Infer the CellProfiler features and metadata from the column names in the parquet schema
+    # (using an empty data frame with the same columns) to only read the columns that are used
+    schema_df = pd.DataFrame(columns=pq.ParquetFile(plate_path).schema_arrow.names)
+    plate_columns = infer_cp_features(schema_df) + [
+        feature
+        for feature in infer_cp_features(schema_df, metadata=True)
+        if feature in desired_columns
+    ]
+    # Memory-map the plate file and release the Arrow buffers as they are converted to pandas
+    cp_df = pq.read_table(
+        plate_path, columns=plate_columns, memory_map=True, use_threads=True
+    ).to_pandas(self_destruct=True, split_blocks=True)
+
+    # Make sure feature columns with any NA values have been removed
+    feature_columns = infer_cp_features(cp_df)
+    na_feature_mask = np.isnan(cp_df[feature_columns].to_numpy(dtype=float)).any(axis=0)
+    cp_df = cp_df.drop(columns=np.array(feature_columns)[na_feature_mask])
+
+    # Process cp_df to separate features and metadata
+    cp_features = infer_cp_features(cp_df)
+    meta_features = infer_cp_features(cp_df, metadata=True)
+    filtered_meta_features = [
+        feature for feature in meta_features if feature in desired_columns
+    ]
+
+    # Fit UMAP on the features as float32 (halves the memory used during fitting) and convert to pandas DataFrame
+    features_array = np.ascontiguousarray(
+        cp_df.loc[:, cp_features].to_numpy(dtype=np.float32)
+    )
+    embeddings = pd.DataFrame(
+        umap_fit.fit_transform(features_array),
+        columns=[f"UMAP{x}" for x in range(0, umap_n_components)],
+    )
+    print(embeddings.shape)
+
+    # Combine with metadata
+    cp_umap_with_metadata_df = pd.concat(
+        [cp_df.loc[:, filtered_meta_features].reset_index(drop=True), embeddings],
+        axis=1,
+    )
+
+    # randomize the rows of the dataframe to plot the order of the data evenly
+    cp_umap_with_metadata_df = cp_umap_with_metadata_df.sample(frac=1, random_state=0)
+
+    # Generate output file and save as a TSV with the Arrow CSV writer, writing the header separately so it is never
+    # quoted and only quoting string values if any of them contain a tab, line break, or quote
+    output_umap_file = pathlib.Path(output_dir, f"UMAP_{plate_name}.tsv")
+    umap_table = pa.Table.from_pandas(cp_umap_with_metadata_df, preserve_index=False)
+    needs_quoting = any(
+        pc.any(
+            pc.match_substring_regex(column.cast(pa.string()), pattern='[\t\n\r"]')
+        ).as_py()
+        for column in umap_table.columns
+        if pa.types.is_string(column.type) or pa.types.is_dictionary(column.type)
+    )
+    with open(output_umap_file, "wb") as umap_file:
+        umap_file.write(("\t".join(umap_table.column_names) + "\n").encode())
+        pacsv.write_csv(
+            umap_table,
+            umap_file,
+            write_options=pacsv.WriteOptions(
+                include_header=False,
+                delimiter="\t",
+                quoting_style="needed" if needs_quoting else "none",
+            ),
+        )
+
+    return plate_name, cp_umap_with_metadata_df